@@ -1,20 +1,27 @@
 import os
+import shutil
 import uuid
-from typing import List, Tuple
+from typing import List
 import streamlit as st
 
-from backend.settings import UPLOAD_DIR, CACHE_DIR, ENABLE_VOICE, MIN_FILES
-from backend.utils.doc_loader import load_text_from_path
-from backend.services.gemini import summarize_doc, chat_llm, embed_texts
+from backend.settings import UPLOAD_DIR, CACHE_DIR, DOC_STORE_PATH, ENABLE_VOICE, MIN_FILES, DOC_MIN_SIM
+from backend.utils.doc_loader import load_pages_from_path
+from backend.services.gemini import summarize_doc, chat_llm
 try:
     from backend.services.gemini import chat_llm_stream
     HAS_STREAM = True
 except Exception:
     HAS_STREAM = False
 
-from backend.rag.index import build_or_update_index
-from backend.rag.qa import PROMPT_SYSTEM
-from backend.rag.rerank import mmr_rerank
+from backend.rag.index import (
+    build_or_update_index, delete_documents, load_index, list_collections,
+    collection_paths, DEFAULT_COLLECTION, COLLECTIONS_DIR,
+)
+from backend.store.doc_store import DocStore
+from backend.store.sharded_store import ShardedStore
+from backend.store.upload_store import UploadStore
+from backend.rag.qa import build_messages, retrieve
+from backend.rag.memory import ConversationMemory
 from backend.utils.audio import transcribe_audio_bytes
 
 # Mic recorder (compact)
@@ -29,11 +36,27 @@ except Exception:
 st.set_page_config(page_title="DocuChat – Summarize and Ask", layout="wide")
 st.title("📄✨ DocuChat – Summarize and Ask")
 
+# -------------------- STORES (shared by all sessions) --------------------
+@st.cache_resource
+def get_upload_store() -> UploadStore:
+    return UploadStore(UPLOAD_DIR)
+
+@st.cache_resource
+def get_doc_store() -> DocStore:
+    return DocStore(DOC_STORE_PATH)
+
+@st.cache_resource
+def get_shards() -> ShardedStore:
+    return ShardedStore(load_index)     # one lazily-loaded VectorStore per collection
+
+doc_store = get_doc_store()
+shards = get_shards()
+
 # -------------------- STATE --------------------
 ss = st.session_state
-ss.setdefault("docs", {})               # {doc_id: {name,path,text,summary,keys}}
-ss.setdefault("vecstore", None)
-ss.setdefault("history", [{"role":"system","content":"You are a helpful assistant."}])
+ss.docs = doc_store.handles()           # {doc_id: {name,sha,collection}} handles; text/summaries live in doc_store
+ss.setdefault("vecstore", None)         # ShardView over the collections selected in the sidebar
+ss.setdefault("memory", ConversationMemory())   # token-bounded chat history + running summary
 ss.setdefault("chat_input", "")
 ss.setdefault("_apply_prefill_text", False)
 ss.setdefault("_prefill_text", "")
@@ -44,13 +67,13 @@ ss.setdefault("scope_ids", [])          # selected doc_ids for filtering
 
 # -------------------- HELPERS --------------------
 def save_uploads(files):
-    paths = []
+    """Stream uploads into the content-addressed store -> [{name, path, sha, is_new}]."""
+    store, out = get_upload_store(), []
     for f in files:
-        dest = os.path.join(UPLOAD_DIR, f.name)
-        with open(dest, "wb") as out:
-            out.write(f.read())
-        paths.append(dest)
-    return paths
+        f.seek(0)
+        path, sha, is_new = store.put_stream(f.name, f)
+        out.append({"name": f.name, "path": path, "sha": sha, "is_new": is_new})
+    return out
 
 def parse_summary(text):
     res = summarize_doc(text, max_words=180)
@@ -67,54 +90,30 @@ def build_doc_md(name: str, summary: str, keys: str) -> str:
         md += ["## Key Points", keys.strip(), ""]
     return "\n".join(md)
 
-def build_all_md(docs: dict) -> str:
+def build_all_md(doc_ids) -> str:
     parts = []
-    for info in docs.values():
+    for did in doc_ids:
+        info = doc_store.get(did)
+        if not info:
+            continue
         parts.append(build_doc_md(info["name"], info["summary"], info["keys"]))
         parts.append("\n---\n")
     return "\n".join(parts).strip()
 
-def _avg_top_sim(hits: List[Tuple[float, dict]], k: int) -> float:
-    if not hits: return 0.0
-    sims = [float(s) for s, _ in hits[:k]]
-    return sum(sims) / max(1, len(sims))
-
-def fetch_context_with_mmr(question: str, k: int = 5, widen: int = 6, allowed_ids: List[str] | None = None):
+def fetch_context_with_mmr(question: str, k: int = 5, widen: int = 6, allowed_ids: List[str] | None = None,
+                           doc_min_sim: float = 0.0):
     """
-    Retrieve a wide set from FAISS, optionally filter by allowed doc_ids,
+    Two-stage retrieval (top documents -> their chunks, or exactly the allowed doc_ids),
     MMR-rerank to k, and return (context, files, avg_score).
     """
-    if ss.vecstore is None or getattr(ss.vecstore, "index", None) is None or ss.vecstore.index.ntotal == 0:
+    hits, score, _ = retrieve(question, ss.vecstore, k=k, widen=widen,
+                              allowed_ids=allowed_ids, doc_min_sim=doc_min_sim)
+    if not hits:
         return "", [], 0.0
 
-    q_emb = embed_texts(question)
-    wide_k = max(k * widen, 30)
-    pre_hits = ss.vecstore.search(q_emb, k=wide_k) or []
-
-    # Filter to selected docs if provided
-    if allowed_ids:
-        filtered = [h for h in pre_hits if h[1].get("doc_id") in set(allowed_ids)]
-        if len(filtered) < k:
-            # try an even wider pull to find enough matches from selected docs
-            pre_hits2 = ss.vecstore.search(q_emb, k=wide_k * 3) or []
-            extra = [h for h in pre_hits2 if h[1].get("doc_id") in set(allowed_ids)]
-            # keep order, avoid duplicates
-            seen = set(id(h) for h in filtered)
-            filtered += [h for h in extra if id(h) not in seen]
-        pre_hits = filtered
-
-    if not pre_hits:
-        return "", [], 0.0
-
-    cand_texts = [m["text"] for _, m in pre_hits]
-    cand_vecs  = embed_texts(cand_texts)
-    order = mmr_rerank(q_emb, cand_texts, cand_vecs, k=k, lambda_mult=0.6)
-    hits  = [pre_hits[i] for i in order]
-    score = _avg_top_sim(hits, k)
-
     chunks, files = [], []
     for s, meta in hits[:k]:
-        fname = meta.get("source_path", "").split("/")[-1]
+        fname = meta.get("name") or meta.get("source_path", "").split("/")[-1]
         files.append(fname)
         chunks.append(f"[{fname}] {meta.get('text','')}")
     context = "\n\n---\n\n".join(chunks)
@@ -142,9 +141,21 @@ with st.sidebar:
         type=["pdf","docx","txt","md"],
         accept_multiple_files=True,
     )
+    ingest_collection = st.text_input("Collection for these uploads", value=DEFAULT_COLLECTION).strip()
     colA, colB = st.columns(2)
     build_idx = colA.button("Process & Index")
     clear_idx = colB.button("Clear Index")
+    # stored by a build that never finished (quota error, crash, closed tab) -> resumed on the next build
+    unindexed = [did for did, info in ss.docs.items()
+                 if info.get("collection") == ingest_collection and not info.get("indexed")]
+    if unindexed:
+        st.caption(f"{len(unindexed)} document(s) in '{ingest_collection}' are not indexed yet; "
+                   "**Process & Index** resumes them.")
+
+    st.markdown("### Collections")
+    available = list_collections()
+    search_collections = st.multiselect("Search in", options=available, default=available)
+    ss.vecstore = shards.view(search_collections)
 
     st.markdown("### Chat Mode")
     chat_mode = st.radio(
@@ -175,14 +186,17 @@ with st.sidebar:
             st.caption("Quick downloads")
             st.download_button(
                 "⬇️ Download all summaries (.md)",
-                data=build_all_md(ss.docs),
+                data=build_all_md(list(ss.docs)),
                 file_name="summaries_all.md",
                 mime="text/markdown",
                 use_container_width=True,
             )
             st.divider()
-            for did, info in ss.docs.items():
-                col1, col2 = st.columns([0.65, 0.35])
+            for did in list(ss.docs):
+                info = doc_store.get(did)
+                if not info:
+                    continue
+                col1, col2, col3 = st.columns([0.5, 0.3, 0.2])
                 col1.write(f"**{info['name']}**")
                 md = build_doc_md(info["name"], info["summary"], info["keys"])
                 col2.download_button(
@@ -193,43 +207,96 @@ with st.sidebar:
                     key=f"dl_{did}",
                     use_container_width=True,
                 )
+                if col3.button("🗑", key=f"del_{did}", help="Remove this document from the index"):
+                    coll = ss.docs[did].get("collection", DEFAULT_COLLECTION)
+                    delete_documents([did], shards.get(coll), collection=coll)
+                    doc_store.delete(did)
+                    ss.docs.pop(did, None)
+                    ss.scope_ids = [i for i in ss.scope_ids if i != did]
+                    st.rerun()
 
     if clear_idx:
         for fn in os.listdir(CACHE_DIR):
+            if fn.startswith(os.path.basename(DOC_STORE_PATH)):
+                continue                # open SQLite files; emptied via doc_store.clear()
             try: os.remove(os.path.join(CACHE_DIR, fn))
             except Exception: pass
-        ss.vecstore = None
+        shutil.rmtree(COLLECTIONS_DIR, ignore_errors=True)
+        shards.unload_all()
+        doc_store.clear()
+        ss.docs = {}
+        ss.scope_ids = []
+        ss.vecstore = shards.view([])
         st.success("Index cleared.")
 
 
 # -------------------- UPLOAD & INDEX --------------------
-if files and build_idx:
-    if len(files) < MIN_FILES:
+if build_idx and (files or unindexed):
+    try:
+        collection_paths(ingest_collection)
+        bad_collection = None
+    except ValueError as e:
+        bad_collection = str(e)
+    if files and len(files) < MIN_FILES:
         st.error(f"Please upload at least {MIN_FILES} file(s) before indexing.")
+    elif bad_collection:
+        st.error(bad_collection)
     else:
-        paths = save_uploads(files)
-        for p in paths:
-            doc_id = str(uuid.uuid4())[:8]
+        uploads = save_uploads(files or [])
+        in_coll = {did: info for did, info in ss.docs.items() if info.get("collection") == ingest_collection}
+        name_to_id = {info["name"]: did for did, info in in_coll.items()}
+        known = {info.get("sha"): info["name"] for info in in_coll.values() if info.get("indexed")}
+        stored = {info.get("sha") for did, info in in_coll.items() if did in unindexed}
+        new_ids = list(unindexed)
+        for up in uploads:
+            # identical bytes already indexed -> skip before any parsing/embedding
+            if up["sha"] in known:
+                st.info(f"{up['name']}: same content as {known[up['sha']]}, skipped.")
+                continue
+            if up["sha"] in stored:     # already parsed and stored; queued for indexing above
+                continue
+            # same file name -> new version of that document (only changed chunks get re-embedded)
+            doc_id = name_to_id.get(up["name"]) or str(uuid.uuid4())[:8]
+            if doc_id in in_coll:
+                st.warning(f"{up['name']}: new content replaces the indexed document of the same name "
+                           f"in '{ingest_collection}'. Rename the file to keep both.")
             try:
-                text = load_text_from_path(p)
+                pages = load_pages_from_path(up["path"])
             except Exception as e:
-                st.error(f"Failed to read {os.path.basename(p)}: {e}")
+                st.error(f"Failed to read {up['name']}: {e}")
                 continue
-            summary, keys = parse_summary(text)
-            ss.docs[doc_id] = {"name": os.path.basename(p), "path": p, "text": text, "summary": summary, "keys": keys}
-        st.success(f"Processed {len(paths)} file(s). Building index…")
-
-        doc_list = [{"doc_id": k, "text": v["text"], "source_path": v["path"]} for k, v in ss.docs.items()]
-        if doc_list:
-            vs, _ = build_or_update_index(doc_list)
-            ss.vecstore = vs
-            st.success("Index ready ✅")
+            summary, keys = parse_summary("\n".join(pages))
+            doc_store.put(doc_id, up["name"], up["path"], pages, sha=up["sha"],
+                          summary=summary, keys=keys, collection=ingest_collection)
+            ss.docs[doc_id] = {"name": up["name"], "sha": up["sha"], "collection": ingest_collection,
+                               "indexed": False}
+            stored.add(up["sha"])
+            if doc_id not in new_ids:
+                new_ids.append(doc_id)
+        st.success(f"Processed {len(new_ids)} file(s). Building index…")
+
+        if new_ids:
+            # texts are streamed from doc_store one document at a time
+            try:
+                vs, _ = build_or_update_index(doc_store.iter_index_docs(new_ids), collection=ingest_collection,
+                                              vs=shards.get(ingest_collection))
+            except Exception as e:
+                st.error(f"Indexing stopped: {e}. Committed batches are kept; **Process & Index** resumes.")
+            else:
+                doc_store.mark_indexed(new_ids)
+                for did in new_ids:
+                    ss.docs[did]["indexed"] = True
+                shards.attach(ingest_collection, vs)
+                st.success("Index ready ✅")
 
 
 # -------------------- SUMMARIES (main) --------------------
 if ss.docs:
     st.subheader("Summaries")
-    for did, info in ss.docs.items():
+    for did in ss.docs:
+        info = doc_store.get(did)
+        if not info:
+            continue
         with st.expander(f"🗂 {info['name']}"):
             st.markdown(f"**Summary**\n\n{info['summary']}")
             if info["keys"]:
@@ -273,57 +340,52 @@ ask_btn   = c_send.button("Send", use_container_width=True)
 clear_btn = st.button("Clear chat")
 
 if clear_btn:
-    ss.history = [{"role":"system","content":"You are a helpful assistant."}]
+    ss.memory.clear()
     ss._clear_input = True
     st.rerun()
 
 if ask_btn:
     question = (ss.chat_input or "").strip()
     if question:
-        ss.history.append({"role": "user", "content": question})
-
+        mem = ss.memory
         # compute allowed_ids once
         allowed_ids = ss.scope_ids if ss.scope_mode == "Selected documents" else None
+        # follow-ups ("what about its results?") -> standalone retrieval query, cached per turn;
+        # skipped when nothing would be retrieved anyway
+        has_index = ss.vecstore is not None and len(ss.vecstore) > 0
+        query = mem.rewrite_query(question) if chat_mode != "General LLM" and has_index else question
 
         if chat_mode == "Docs-only":
-            context, files, score = fetch_context_with_mmr(question, k=5, widen=6, allowed_ids=allowed_ids)
+            context, files, score = fetch_context_with_mmr(query, k=5, widen=6, allowed_ids=allowed_ids)
             if not context:
-                msgs = [{"role":"system","content":PROMPT_SYSTEM},
-                        {"role":"user","content":"No matching context in selected docs. " + question}]
-                final = stream_or_call(msgs)
-                ss.history.append({"role":"assistant","content":final})
+                final = stream_or_call(build_messages("No matching context in selected docs. " + question, memory=mem))
             else:
-                msgs = [{"role":"system","content":PROMPT_SYSTEM},
-                        {"role":"user","content":f"Question: {question}\n\nContext:\n{context}"}]
-                final = stream_or_call(msgs)
-                ss.history.append({"role":"assistant","content":final})
+                final = stream_or_call(build_messages(question, context, mem))
                 if files: st.caption("Sources: " + ", ".join(files))
 
         elif chat_mode == "General LLM":
-            msgs = [{"role":"system","content":PROMPT_SYSTEM},
-                    {"role":"user","content":question}]
-            final = stream_or_call(msgs)
-            ss.history.append({"role":"assistant","content":final})
+            final = stream_or_call(build_messages(question, memory=mem))
 
         else:  # Auto (smart)
-            context, files, score = fetch_context_with_mmr(question, k=5, widen=6, allowed_ids=allowed_ids)
+            # document-level stage gives an early "not in the docs" signal before any chunk search
+            context, files, score = fetch_context_with_mmr(query, k=5, widen=6, allowed_ids=allowed_ids,
+                                                           doc_min_sim=DOC_MIN_SIM)
             if context and score >= 0.28:
-                msgs = [{"role":"system","content":PROMPT_SYSTEM},
-                        {"role":"user","content":f"Question: {question}\n\nContext:\n{context}"}]
-                final = stream_or_call(msgs)
-                ss.history.append({"role":"assistant","content":final})
+                final = stream_or_call(build_messages(question, context, mem))
                 if files: st.caption("Sources: " + ", ".join(files))
             else:
-                msgs = [{"role":"system","content":PROMPT_SYSTEM},
-                        {"role":"user","content":question}]
-                final = stream_or_call(msgs)
-                ss.history.append({"role":"assistant","content":final})
+                final = stream_or_call(build_messages(question, memory=mem))
+
+        mem.add("user", question)
+        mem.add("assistant", final)
 
     ss._clear_input = True
     st.rerun()
 
-# history render
-for msg in ss.history:
+# history render (bounded: running summary + recent window only)
+if ss.memory.summary:
+    st.caption("Earlier in this chat: " + ss.memory.summary)
+for msg in ss.memory.turns:
     if msg["role"] == "user":
         st.chat_message("user").markdown(msg["content"])
     else:
@@ -1,44 +1,203 @@
 # backend/rag/index.py
 import os
-from typing import List, Dict, Tuple
-from backend.settings import CACHE_DIR
+import re
+import time
+from typing import Dict, Iterable, List, Tuple
+from backend.settings import (
+    CACHE_DIR, COMPACT_RATIO, NEAR_DUP_THRESHOLD,
+    CHECKPOINT_EVERY, CHECKPOINT_GROWTH, CHECKPOINT_SECONDS,
+)
 from backend.utils.text_chunk import split_text
-from backend.utils.dedupe import chunk_hash
+from backend.utils.dedupe import chunk_hash, minhash_signature, NearDupIndex
 from backend.services.gemini import embed_texts
 from backend.store.vector_store import VectorStore
 import os
 
 EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "8"))
 
-def build_or_update_index(docs: List[Dict[str, str]]) -> Tuple[VectorStore, int]:
-    index_path = os.path.join(CACHE_DIR, "index.faiss")
-    meta_path  = os.path.join(CACHE_DIR, "meta.json")
+INDEX_PATH = os.path.join(CACHE_DIR, "index.faiss")
+META_PATH  = os.path.join(CACHE_DIR, "meta.json")
 
-    dim = len(embed_texts("probe dim"))  # single call -> safe
-    vs = VectorStore(index_path, meta_path, dim)
+# Named collections: "default" keeps the original data/cache/{index.faiss,meta.json};
+# every other collection gets its own shard under data/cache/collections/<name>/.
+DEFAULT_COLLECTION = "default"
+COLLECTIONS_DIR = os.path.join(CACHE_DIR, "collections")
+_COLLECTION_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def collection_paths(collection: str = DEFAULT_COLLECTION) -> Tuple[str, str]:
+    """Index/meta paths for a collection (validates the name; the directory is created on first save)."""
+    if collection == DEFAULT_COLLECTION:
+        return INDEX_PATH, META_PATH
+    if not _COLLECTION_RE.match(collection or ""):
+        raise ValueError(f"Invalid collection name: {collection!r} (use letters, digits, '_' or '-')")
+    d = os.path.join(COLLECTIONS_DIR, collection)
+    return os.path.join(d, "index.faiss"), os.path.join(d, "meta.json")
+
+def list_collections() -> List[str]:
+    names = [DEFAULT_COLLECTION] if os.path.exists(INDEX_PATH) else []
+    if os.path.isdir(COLLECTIONS_DIR):
+        names += sorted(n for n in os.listdir(COLLECTIONS_DIR)
+                        if os.path.exists(os.path.join(COLLECTIONS_DIR, n, "index.faiss")))
+    return names
+
+def load_index(collection: str = DEFAULT_COLLECTION) -> VectorStore | None:
+    """Open a collection's on-disk index without an embedding call (dim comes from the file)."""
+    index_path, meta_path = collection_paths(collection)
+    if not os.path.exists(index_path):
+        return None
+    vs = VectorStore(index_path, meta_path, 0)
     vs.load()
+    return vs
+
+def _maybe_compact(vs: VectorStore, background: bool = True):
+    """Compact once enough chunks are tombstoned; `background=False` for short-lived processes (CLI)."""
+    if vs.tombstone_ratio() >= COMPACT_RATIO:
+        if background:
+            vs.compact_in_background()
+        else:
+            vs.compact()
+
+def delete_documents(
+    doc_ids: List[str],
+    vs: VectorStore | None = None,
+    collection: str = DEFAULT_COLLECTION,
+    background_compact: bool = True,
+) -> int:
+    """Tombstone every chunk of the given documents; compaction runs in the background
+    unless `background_compact=False` (then it runs before returning)."""
+    if vs is None:
+        vs = load_index(collection)
+    if vs is None:
+        return 0
+    with vs.writing():
+        n = sum(vs.delete_doc(d) for d in doc_ids)
+        if n:
+            vs.save()
+    if n:
+        _maybe_compact(vs, background_compact)
+    return n
 
-    existing_hashes = {m.get("hash") for m in (vs.meta or []) if isinstance(m, dict) and m.get("hash")}
-    seen_hashes: set = set()
+def build_or_update_index(
+    docs: Iterable[Dict[str, str]],
+    checkpoint_every: int = CHECKPOINT_EVERY,
+    collection: str = DEFAULT_COLLECTION,
+    vs: VectorStore | None = None,
+    background_compact: bool = True,
+) -> Tuple[VectorStore, int]:
+    """
+    Add new chunks for `docs`. Each doc is treated as the current version of its
+    `doc_id`: chunks of that doc whose text no longer appears are tombstoned, unchanged
+    chunks keep their vectors, so replacing a revised file only embeds what changed.
+    Chunks that are exact or near-duplicates (MinHash, NEAR_DUP_THRESHOLD) of an indexed
+    or already-queued chunk of another document are not embedded again: the kept twin
+    records the document in its `aliases`, so the document's scope, doc vectors and
+    deletes still cover that content.
+
+    New vectors are committed (add + atomic save) every `checkpoint_every` chunks, or
+    CHECKPOINT_GROWTH x the store size once that is larger (each commit rewrites the
+    whole index, so a fixed interval would make total write I/O quadratic), and at
+    least every CHECKPOINT_SECONDS. A crash loses at most one batch; re-running with
+    the same docs resumes: committed chunks are skipped by hash. The whole build runs
+    in `vs.writing()`, so concurrent builds/deletes (other threads or processes) queue.
+
+    Writes into `collection`'s shard; pass `vs` to reuse an already-loaded shard.
+    Pass `background_compact=False` when the process may exit right after (CLI).
+    """
+    dim = len(embed_texts("probe dim"))  # single call -> safe
+    if vs is None:
+        vs = VectorStore(*collection_paths(collection), dim)
+    with vs.writing():
+        _add_docs(vs, docs, checkpoint_every)
+    _maybe_compact(vs, background_compact)
+
+    return vs, dim
 
-    vectors, metas = [], []
+def _add_docs(vs: VectorStore, docs: Iterable[Dict[str, str]], checkpoint_every: int):
+    """Body of `build_or_update_index`; runs inside `vs.writing()`."""
+    committed = vs.ref_index()      # chunk hash -> chunk_id standing for it (may be stale; see has_ref)
+    pending: Dict[str, dict] = {}   # chunk hash -> queued (not yet committed) chunk meta standing for it
+    pending_dups = NearDupIndex()   # near-dup index for chunks queued in this run
+    dirty = False
+    last_commit = time.monotonic()
+
+    vectors, metas, sigs = [], [], []
+
+    def _due() -> bool:
+        return (len(vectors) >= max(checkpoint_every, int(len(vs) * CHECKPOINT_GROWTH))
+                or time.monotonic() - last_commit >= CHECKPOINT_SECONDS)
+
+    def _checkpoint():
+        nonlocal dirty, last_commit
+        if vectors:
+            vs.add(vectors, metas, sigs if NEAR_DUP_THRESHOLD > 0 else None)
+            for m in metas:             # committed -> tracked by the store from now on
+                for ref in [m, *m.get("aliases", {}).values()]:
+                    committed[ref["hash"]] = m["chunk_id"]
+                    pending.pop(ref["hash"], None)
+                pending_dups.remove(m["hash"])
+            vectors.clear(); metas.clear(); sigs.clear()
+            dirty = True
+        if dirty:
+            vs.save()
+            dirty = False
+        last_commit = time.monotonic()
 
     for d in docs:
+        doc_id = d["doc_id"]
         chunks = split_text(d["text"])
-        to_embed, to_meta = [], []
+        hashes = [chunk_hash(ch) for ch in chunks]
+        new_hashes = set(hashes)
+        ref_base = {"source_path": d["source_path"],
+                    "name": d.get("name") or os.path.basename(d["source_path"])}
+
+        # ---- drop this doc's references from a previous version ----
+        stale = [m["chunk_id"] for m in vs.live_chunks(doc_id)
+                 if vs.doc_ref(m, doc_id)["hash"] not in new_hashes]
+        if vs.release(doc_id, stale):
+            dirty = True
+        own = {vs.doc_ref(m, doc_id)["hash"] for m in vs.live_chunks(doc_id)}
+
+        def _share(h, cid=None, queued=None):
+            """Point this doc's chunk `h` at a committed chunk or a queued one."""
+            nonlocal dirty
+            ref = {"hash": h, **ref_base}
+            if cid is not None:
+                dirty |= vs.alias(cid, doc_id, ref)
+                committed[h] = cid
+            elif queued["doc_id"] != doc_id:
+                queued.setdefault("aliases", {})[doc_id] = ref
+                pending[h] = queued
 
-        for ch in chunks:
-            h = chunk_hash(ch)
-            if h in existing_hashes or h in seen_hashes:
+        to_embed, to_meta, to_sig = [], [], []
+
+        for ch, h in zip(chunks, hashes):
+            if h in own:
+                continue
+            own.add(h)
+            cid = committed.get(h)
+            if cid is not None and vs.has_ref(cid, h):
+                _share(h, cid=cid)
+                continue
+            if h in pending:
+                _share(h, queued=pending[h])
                 continue
-            seen_hashes.add(h)
+            sig = None
+            if NEAR_DUP_THRESHOLD > 0:
+                sig = minhash_signature(ch)
+                cid = vs.near_dup.query(sig, NEAR_DUP_THRESHOLD)
+                if cid is not None:
+                    _share(h, cid=cid)
+                    continue
+                twin = pending_dups.query(sig, NEAR_DUP_THRESHOLD)
+                if twin is not None:
+                    _share(h, queued=pending[twin])
+                    continue
+                pending_dups.add(h, sig)
+            meta = {"doc_id": doc_id, **ref_base, "hash": h, "text": ch}
+            pending[h] = meta
+            to_sig.append(sig)
             to_embed.append(ch)
-            to_meta.append({
-                "doc_id": d["doc_id"],
-                "source_path": d["source_path"],
-                "hash": h,
-                "text": ch
-            })
+            to_meta.append(meta)
 
         # ---- NEW: embed in batches ----
         for i in range(0, len(to_embed), EMBED_BATCH_SIZE):
@@ -49,9 +208,8 @@ def build_or_update_index(docs: List[Dict[str, str]]) -> Tuple[VectorStore, int]
             embs = embed_texts(batch_texts)     # returns list[vectors]
             vectors.extend(embs)
             metas.extend(batch_meta)
+            sigs.extend(to_sig[i:i + EMBED_BATCH_SIZE])
+            if _due():
+                _checkpoint()
 
-    if vectors:
-        vs.add(vectors, metas)
-        vs.save()
-
-    return vs, dim
+    _checkpoint()
@@ -0,0 +1,174 @@
+# backend/rag/memory.py
+import re
+import threading
+from typing import Dict, List, Tuple
+from backend.services.gemini import chat_llm
+from backend.settings import MEMORY_MAX_TOKENS, MEMORY_SUMMARY_WORDS
+
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars/token), good enough for budgeting."""
+    return max(1, len(text or "") // CHARS_PER_TOKEN)
+
+def _fit(texts: List[str], budget_chars: int) -> List[str]:
+    """Clip texts to a shared character budget; short ones keep their full length (water-filling)."""
+    caps, remaining = {}, budget_chars
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    for j, i in enumerate(order):
+        caps[i] = min(len(texts[i]), remaining // (len(order) - j))
+        remaining -= caps[i]
+    return [t if caps[i] >= len(t) else t[:caps[i]].rstrip() + " …[truncated]"
+            for i, t in enumerate(texts)]
+
+# Words that point back into the conversation; questions without any (and longer than a
+# few words) are taken as standalone and skip the rewrite call.
+_REFERENCE_RE = re.compile(
+    r"\b(it|its|they|them|their|this|that|these|those|he|him|his|she|her|there|"
+    r"former|latter|above|previous|earlier|same|also|else|more|again|other|another|one|ones)\b"
+    r"|^(and|but|so|what about|how about)\b",
+    re.IGNORECASE,
+)
+
+def is_follow_up(question: str) -> bool:
+    """True when `question` may depend on earlier turns (very short, or uses a reference word)."""
+    q = question.strip()
+    return len(q.split()) <= 3 or bool(_REFERENCE_RE.search(q))
+
+class ConversationMemory:
+    """
+    Token-bounded chat memory.
+
+    Recent exchanges (user question + assistant reply, kept or dropped together) stay
+    verbatim while they fit in `max_tokens`. On overflow the window drops to half the
+    budget and the dropped exchanges are folded into a short running summary on a
+    background thread, so a summary call happens every few exchanges and never on the
+    answer's critical path. An exchange too large for the budget on its own is clipped
+    in `context_block()`, so prompt size stays bounded however long the chat runs.
+
+    `rewrite_query()` turns follow-ups ("what about its results?") into standalone
+    retrieval queries; questions with no reference to the conversation (see
+    `is_follow_up`) are used as-is without an LLM call.
+    """
+    def __init__(self, max_tokens: int = MEMORY_MAX_TOKENS,
+                 summary_words: int = MEMORY_SUMMARY_WORDS, chat_fn=chat_llm):
+        self.max_tokens = max_tokens
+        self.summary_words = summary_words
+        self.chat_fn = chat_fn
+        self.summary = ""
+        self.turns: List[Dict[str, str]] = []    # recent {"role", "content"}, oldest first
+        self.user_turns = 0
+        self._rewrites: Dict[Tuple[int, str], str] = {}     # current turn only (reruns/retries)
+        self._fold_lock = threading.Lock()
+        self._pending: List[Dict[str, str]] = []    # dropped turns not yet in the summary
+        self._folder = None                         # background summary thread
+        self._generation = 0                        # bumped by clear(); stale folds are discarded
+
+    def clear(self):
+        with self._fold_lock:
+            self.summary = ""
+            self._pending = []
+            self._generation += 1
+        self.turns = []
+        self.user_turns = 0
+        self._rewrites = {}
+
+    def add(self, role: str, content: str):
+        self.turns.append({"role": role, "content": content})
+        if role == "user":
+            self.user_turns += 1
+            self._rewrites = {k: v for k, v in self._rewrites.items() if k[0] >= self.user_turns}
+        else:
+            self._compact()
+
+    def _window_tokens(self) -> int:
+        return sum(estimate_tokens(t["content"]) for t in self.turns)
+
+    def _compact(self):
+        """Over budget -> drop the oldest exchanges down to half the budget (keeps the last one) and fold them."""
+        if self._window_tokens() <= self.max_tokens:
+            return
+        overflow = []
+        while self._window_tokens() > self.max_tokens // 2:
+            n = 2 if len(self.turns) >= 2 and self.turns[0]["role"] == "user" else 1
+            if len(self.turns) <= n:
+                break
+            overflow += self.turns[:n]
+            del self.turns[:n]
+        if overflow:
+            with self._fold_lock:
+                self._pending += overflow
+                if self._folder is None:
+                    self._folder = threading.Thread(target=self._fold, name="memory-fold", daemon=True)
+                    self._folder.start()
+
+    def _fold(self):
+        """Background: fold pending turns into the running summary until none are left."""
+        while True:
+            with self._fold_lock:
+                turns, self._pending = self._pending, []
+                previous, generation = self.summary, self._generation
+                if not turns:
+                    self._folder = None
+                    return
+            summary = self._summarize(previous, turns)
+            with self._fold_lock:
+                if generation == self._generation:
+                    self.summary = summary
+
+    def wait(self, timeout: float | None = None):
+        """Block until pending turns are folded into the summary (batch jobs, tests)."""
+        folder = self._folder
+        if folder is not None:
+            folder.join(timeout)
+
+    def _summarize(self, previous: str, turns: List[Dict[str, str]]) -> str:
+        convo = "\n".join(f"{t['role'].capitalize()}: {t['content'][:2000]}" for t in turns)
+        prompt = (
+            f"Update the running summary of a conversation in at most {self.summary_words} words. "
+            "Keep the topics, documents, entities and open questions a follow-up might refer to.\n\n"
+            f"Current summary:\n{previous or '(empty)'}\n\nNew turns:\n{convo}\n\nUpdated summary:"
+        )
+        try:
+            out = self.chat_fn([{"role": "user", "content": prompt}]).strip()
+        except Exception:
+            out = ""
+        if not out:  # API unavailable -> keep the most recent words verbatim
+            out = f"{previous} {convo}".strip()
+            return " ".join(out.split()[-self.summary_words:])
+        return " ".join(out.split()[:self.summary_words])
+
+    def context_block(self) -> str:
+        """Summary + recent turns, formatted for a prompt ('' when there is no history)."""
+        parts = []
+        if self.summary:
+            parts.append(f"Conversation so far (summary):\n{self.summary}")
+        with self._fold_lock:
+            turns = self._pending + self.turns     # turns still being folded stay visible
+        if turns:
+            contents = [t["content"] for t in turns]
+            if sum(estimate_tokens(c) for c in contents) > self.max_tokens:
+                contents = _fit(contents, self.max_tokens * CHARS_PER_TOKEN)
+            recent = "\n".join(f"{t['role'].capitalize()}: {c}" for t, c in zip(turns, contents))
+            parts.append(f"Recent conversation:\n{recent}")
+        return "\n\n".join(parts)
+
+    def rewrite_query(self, question: str) -> str:
+        """Standalone version of `question` for retrieval; unchanged without history or references."""
+        if (not self.turns and not self.summary) or not is_follow_up(question):
+            return question
+        key = (self.user_turns, question)
+        if key in self._rewrites:
+            return self._rewrites[key]
+        prompt = (
+            "Rewrite the user's latest question as a standalone search query, resolving "
+            "pronouns and references from the conversation. Reply with ONLY the query.\n\n"
+            f"{self.context_block()}\n\nLatest question: {question}\n\nStandalone query:"
+        )
+        try:
+            out = self.chat_fn([{"role": "user", "content": prompt}]).strip().strip('"')
+        except Exception:
+            out = ""
+        rewritten = out.splitlines()[0].strip() if out else question
+        self._rewrites[key] = rewritten or question
+        return self._rewrites[key]
@@ -2,7 +2,7 @@
 
 from typing import List, Tuple
 from backend.services.gemini import chat_llm, embed_texts
-from backend.settings import RAG_K
+from backend.settings import RAG_K, TWO_STAGE_DOCS, DOC_MIN_SIM
 from backend.rag.rerank import mmr_rerank
 
 PROMPT_SYSTEM = """You are a helpful AI assistant (like ChatGPT).
@@ -17,13 +17,13 @@ Rules:
 def _format_context(hits: List[Tuple[float, dict]], k: int) -> Tuple[str, List[str]]:
     """
     hits: list of (similarity_score, metadata) where metadata has keys:
-          'text', 'source_path'
+          'text', 'source_path' (and 'name', the original file name, when known)
     Returns a context string and unique list of filenames for UI display.
     """
     chunks: List[str] = []
     files: List[str] = []
     for score, meta in hits[:k]:
-        fname = meta.get("source_path", "").split("/")[-1]
+        fname = meta.get("name") or meta.get("source_path", "").split("/")[-1]
         files.append(fname)
         chunks.append(f"[{fname}] {meta.get('text', '')}")
     unique_files = list(dict.fromkeys(files))
@@ -35,37 +35,88 @@ def _avg_top_sim(hits: List[Tuple[float, dict]], k: int) -> float:
     sims = [float(s) for s, _ in hits[:k]]
     return sum(sims) / max(1, len(sims))
 
-def _search_with_rerank(question: str, vecstore, embed_fn, k: int, widen: int = 6):
+def _search_with_rerank(question: str, vecstore, embed_fn, k: int, widen: int = 6,
+                        doc_ids=None, q_emb=None):
     """
-    1) Retrieve a wider set from the vector store.
-    2) Compute embeddings of candidates.
+    1) Retrieve a wider set from the vector store (only `doc_ids`' chunks if given).
+    2) Look up the stored vectors of the candidates (falls back to re-embedding).
     3) MMR rerank to pick top-k diverse & relevant chunks.
     Returns: hits (re-ranked list of (score, meta)), avg_score
     """
-    q_emb = embed_fn(question)  # query embedding
+    if q_emb is None:
+        q_emb = embed_fn(question)  # query embedding
     wide_k = max(k * widen, 30)
-    pre_hits = vecstore.search(q_emb, k=wide_k) if vecstore else []
+    if vecstore is None:
+        return [], 0.0
+    if doc_ids is not None:
+        pre_hits = vecstore.search(q_emb, k=wide_k, doc_ids=doc_ids)
+    else:
+        pre_hits = vecstore.search(q_emb, k=wide_k)
     if not pre_hits:
         return [], 0.0
 
     cand_texts = [m["text"] for _, m in pre_hits]
-    cand_vecs = embed_fn(cand_texts)  # list of vectors
+    cand_vecs = vecstore.vectors_for([m for _, m in pre_hits]) if hasattr(vecstore, "vectors_for") else None
+    if cand_vecs is None:
+        cand_vecs = embed_fn(cand_texts)  # list of vectors
     order = mmr_rerank(q_emb, cand_texts, cand_vecs, k=k, lambda_mult=0.6)
     hits = [pre_hits[i] for i in order]
     return hits, _avg_top_sim(hits, k)
 
-def answer_with_context(question: str, vecstore, embed_fn=embed_texts, k: int = RAG_K):
+def retrieve(question: str, vecstore, embed_fn=embed_texts, k: int = RAG_K, widen: int = 6,
+             allowed_ids=None, top_docs: int = TWO_STAGE_DOCS, doc_min_sim: float = 0.0):
+    """
+    Coarse-to-fine retrieval.
+      - allowed_ids: search only those documents' chunks (document scope).
+      - otherwise stage 1 ranks documents by centroid/section vectors and stage 2
+        searches only the chunks of the best `top_docs` documents.
+      - if the best document scores below `doc_min_sim`, stop after stage 1.
+    Returns: (hits, avg_score, best_doc_score)
+    """
+    if vecstore is None or len(vecstore) == 0:
+        return [], 0.0, 0.0
+    q_emb = embed_fn(question)
+    if allowed_ids:
+        hits, score = _search_with_rerank(question, vecstore, embed_fn, k, widen,
+                                          doc_ids=list(allowed_ids), q_emb=q_emb)
+        return hits, score, score
+    if top_docs <= 0 or not hasattr(vecstore, "top_docs"):
+        hits, score = _search_with_rerank(question, vecstore, embed_fn, k, widen, q_emb=q_emb)
+        return hits, score, score
+    doc_hits = vecstore.top_docs(q_emb, n=top_docs)
+    doc_score = doc_hits[0][0] if doc_hits else 0.0
+    if not doc_hits or doc_score < doc_min_sim:
+        return [], 0.0, doc_score
+    hits, score = _search_with_rerank(question, vecstore, embed_fn, k, widen,
+                                      doc_ids=[d for _, d in doc_hits], q_emb=q_emb)
+    return hits, score, doc_score
+
+def build_messages(question: str, context: str = "", memory=None) -> List[dict]:
+    """System prompt + user turn, prefixed with the bounded conversation memory if any."""
+    user = f"Question: {question}\n\nContext:\n{context}" if context else question
+    history = memory.context_block() if memory is not None else ""
+    if history:
+        user = f"{history}\n\n{user}"
+    return [{"role": "system", "content": PROMPT_SYSTEM},
+            {"role": "user", "content": user}]
+
+def _remember(memory, question: str, answer: str):
+    if memory is not None:
+        memory.add("user", question)
+        memory.add("assistant", answer)
+
+def answer_with_context(question: str, vecstore, embed_fn=embed_texts, k: int = RAG_K, memory=None):
     """
     Always produce a context-grounded answer (Docs-only mode).
     Uses widened recall + MMR rerank before prompting the LLM.
+    With a ConversationMemory, follow-ups are rewritten into standalone queries for
+    retrieval and the turn is recorded afterwards.
     """
-    hits, score = _search_with_rerank(question, vecstore, embed_fn, k=k)
+    query = memory.rewrite_query(question) if memory is not None else question
+    hits, score, _ = retrieve(query, vecstore, embed_fn, k=k)
     context, files = _format_context(hits, k)
-    messages = [
-        {"role": "system", "content": PROMPT_SYSTEM},
-        {"role": "user", "content": f"Question: {question}\n\nContext:\n{context}"}
-    ]
-    ans = chat_llm(messages)
+    ans = chat_llm(build_messages(question, context, memory))
+    _remember(memory, question, ans)
     return ans, files, score
 
 def route_and_answer(
@@ -75,33 +126,37 @@ def route_and_answer(
     k: int = RAG_K,
     min_sim: float = 0.28,
     widen: int = 6,
+    doc_min_sim: float = DOC_MIN_SIM,
+    memory=None,
 ):
     """
     AUTO router:
-      - Retrieve wide, MMR-rerank to k.
+      - Stage 1: if no document vector reaches doc_min_sim -> general LLM right away.
+      - Retrieve wide within the top documents, MMR-rerank to k.
       - If avg top-k similarity >= min_sim -> use RAG (grounded).
       - Else -> general LLM (no context).
 
+    With `memory` (ConversationMemory), retrieval uses the standalone rewrite of the
+    question, prompts carry the bounded history, and the turn is recorded.
+
     Returns: (answer, files_used, used_docs: bool, score: float)
     """
     # No index -> general LLM
-    if vecstore is None or getattr(vecstore, "index", None) is None or vecstore.index.ntotal == 0:
-        msgs = [{"role": "system", "content": PROMPT_SYSTEM},
-                {"role": "user", "content": question}]
-        return chat_llm(msgs), [], False, 0.0
+    if vecstore is None or len(vecstore) == 0:
+        ans = chat_llm(build_messages(question, memory=memory))
+        _remember(memory, question, ans)
+        return ans, [], False, 0.0
 
-    hits, score = _search_with_rerank(question, vecstore, embed_fn, k=k, widen=widen)
+    query = memory.rewrite_query(question) if memory is not None else question
+    hits, score, _ = retrieve(query, vecstore, embed_fn, k=k, widen=widen, doc_min_sim=doc_min_sim)
 
     if hits and score >= min_sim:
         context, files = _format_context(hits, k)
-        msgs = [
-            {"role": "system", "content": PROMPT_SYSTEM},
-            {"role": "user", "content": f"Question: {question}\n\nContext:\n{context}"}
-        ]
-        ans = chat_llm(msgs)
+        ans = chat_llm(build_messages(question, context, memory))
+        _remember(memory, question, ans)
         return ans, files, True, score
 
     # Low confidence → general LLM answer
-    msgs = [{"role": "system", "content": PROMPT_SYSTEM},
-            {"role": "user", "content": question}]
-    return chat_llm(msgs), [], False, score
+    ans = chat_llm(build_messages(question, memory=memory))
+    _remember(memory, question, ans)
+    return ans, [], False, score
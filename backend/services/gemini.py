@@ -1,4 +1,4 @@
-import os, time, random, re
+import os, time, random, re, threading
 import google.generativeai as genai
 from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, DeadlineExceeded
 
@@ -18,17 +18,19 @@ INITIAL_BACKOFF  = float(os.getenv("GENAI_BACKOFF",  "1.0"))
 MAX_QPS          = float(os.getenv("GENAI_MAX_QPS",  "0.8"))  # <= 1 req/sec
 
 _last_call_ts = 0.0
+_throttle_lock = threading.Lock()
 def _throttle():
-    """Simple client-side QPS limiter across all Gemini calls."""
+    """Simple client-side QPS limiter across all Gemini calls (thread-safe)."""
     global _last_call_ts
     if MAX_QPS <= 0: 
         return
     min_interval = 1.0 / MAX_QPS
-    now = time.monotonic()
-    wait = _last_call_ts + min_interval - now
-    if wait > 0:
-        time.sleep(wait)
-    _last_call_ts = time.monotonic()
+    with _throttle_lock:
+        now = time.monotonic()
+        wait = _last_call_ts + min_interval - now
+        if wait > 0:
+            time.sleep(wait)
+        _last_call_ts = time.monotonic()
 
 def _retry_call(fn, *args, **kwargs):
     """Retry with exponential backoff on common transient errors / quota bursts."""
@@ -24,3 +24,36 @@ TTS_ENGINE   = os.getenv("TTS_ENGINE", "gtts")
 
 # NEW: minimum files required to index (default 1)
 MIN_FILES = int(os.getenv("MIN_FILES", "1"))
+
+# Index maintenance: compact (drop tombstoned vectors) once this share of chunks is deleted
+COMPACT_RATIO = float(os.getenv("COMPACT_RATIO", "0.2"))
+
+# Near-duplicate chunks (MinHash/LSH): skip chunks whose estimated Jaccard similarity to an
+# indexed chunk is >= this threshold. Set to 0 to disable.
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.85"))
+
+# Index builds commit (add + atomic save) every N new chunks, so a crash or quota error
+# only loses the current batch; re-running the build resumes from the last checkpoint.
+# Every commit rewrites the whole index, so the interval grows with the store (at least
+# CHECKPOINT_GROWTH x live chunks) and a commit also happens after CHECKPOINT_SECONDS.
+CHECKPOINT_EVERY   = int(os.getenv("CHECKPOINT_EVERY", "64"))
+CHECKPOINT_GROWTH  = float(os.getenv("CHECKPOINT_GROWTH", "0.25"))
+CHECKPOINT_SECONDS = float(os.getenv("CHECKPOINT_SECONDS", "300"))
+
+# Extraction cache: parsed/OCR'd page text keyed by file content hash (size-bounded, LRU)
+EXTRACT_CACHE_DIR    = os.path.join(CACHE_DIR, "extract")
+EXTRACT_CACHE_MAX_MB = int(os.getenv("EXTRACT_CACHE_MAX_MB", "512"))
+
+# Document store (text per page, summaries) shared by all sessions and the CLI
+DOC_STORE_PATH = os.path.join(CACHE_DIR, "docs.sqlite")
+
+# Two-stage retrieval: rank documents by their centroid/section vectors, then search only
+# the chunks of the top TWO_STAGE_DOCS documents (0 = always scan every chunk).
+# In Auto mode a best-document similarity below DOC_MIN_SIM skips chunk search entirely.
+TWO_STAGE_DOCS = int(os.getenv("TWO_STAGE_DOCS", "8"))
+DOC_MIN_SIM    = float(os.getenv("DOC_MIN_SIM", "0.2"))
+
+# Conversation memory: recent turns kept verbatim up to this token budget; older turns
+# are folded into a running summary of at most MEMORY_SUMMARY_WORDS words.
+MEMORY_MAX_TOKENS    = int(os.getenv("MEMORY_MAX_TOKENS", "1500"))
+MEMORY_SUMMARY_WORDS = int(os.getenv("MEMORY_SUMMARY_WORDS", "150"))
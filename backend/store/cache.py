@@ -1,4 +1,9 @@
 import os, json
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:     # Windows: no advisory locks -> single-process use only
+    fcntl = None
 
 def save_json(path, obj):
     os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -10,3 +15,27 @@ def load_json(path, default=None):
         return default
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
+
+def write_bytes_durable(path, data: bytes):
+    """Write + fsync, so the bytes are on disk before any later os.replace()."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def save_json_durable(path, obj):
+    write_bytes_durable(path, json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+@contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on `path` (created if missing) for the duration of the block."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,118 @@
+# backend/store/doc_store.py
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id  TEXT PRIMARY KEY,
+    name    TEXT NOT NULL,
+    path    TEXT NOT NULL,
+    sha     TEXT,
+    summary TEXT NOT NULL DEFAULT '',
+    keys    TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    collection TEXT NOT NULL DEFAULT 'default',
+    indexed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS docs_sha ON docs(sha);
+CREATE TABLE IF NOT EXISTS pages (
+    doc_id  TEXT NOT NULL REFERENCES docs(doc_id) ON DELETE CASCADE,
+    page_no INTEGER NOT NULL,
+    text    TEXT NOT NULL,
+    PRIMARY KEY (doc_id, page_no)
+);
+"""
+
+class DocStore:
+    """
+    SQLite-backed document store: per-page text plus summary/key points per doc_id.
+    Sessions keep only lightweight handles ({doc_id: {name, sha, collection, indexed}}) and load
+    text or summaries by doc_id on demand. One connection, shared across threads behind a lock.
+    `indexed` is set by `mark_indexed()` once a build has committed the doc's chunks, so docs
+    stored by an interrupted build can be told apart and re-queued.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(_SCHEMA)
+            cols = {r["name"] for r in self._db.execute("PRAGMA table_info(docs)")}
+            if "collection" not in cols:    # stores created before collections existed
+                self._db.execute("ALTER TABLE docs ADD COLUMN collection TEXT NOT NULL DEFAULT 'default'")
+            if "indexed" not in cols:       # rows from before the flag: assume their builds finished
+                self._db.execute("ALTER TABLE docs ADD COLUMN indexed INTEGER NOT NULL DEFAULT 1")
+
+    def put(self, doc_id: str, name: str, path: str, pages: List[str], sha: str | None = None,
+            summary: str = "", keys: str = "", collection: str = "default"):
+        """Insert or replace a document and all of its pages (not indexed until `mark_indexed`)."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+            self._db.execute(
+                "INSERT INTO docs (doc_id, name, path, sha, summary, keys, created, collection, indexed)"
+                " VALUES (?,?,?,?,?,?,?,?,0)",
+                (doc_id, name, path, sha, summary, keys, time.time(), collection),
+            )
+            self._db.executemany(
+                "INSERT INTO pages (doc_id, page_no, text) VALUES (?,?,?)",
+                [(doc_id, i, t) for i, t in enumerate(pages)],
+            )
+
+    def mark_indexed(self, doc_ids: Iterable[str]):
+        with self._lock, self._db:
+            self._db.executemany("UPDATE docs SET indexed = 1 WHERE doc_id = ?", [(d,) for d in doc_ids])
+
+    def delete(self, doc_id: str, collection: str | None = None):
+        """Delete a document (only if it belongs to `collection`, when given)."""
+        with self._lock, self._db:
+            if collection is None:
+                self._db.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+            else:
+                self._db.execute("DELETE FROM docs WHERE doc_id = ? AND collection = ?", (doc_id, collection))
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM docs")
+
+    # ---------- reads ----------
+    def handles(self) -> Dict[str, Dict[str, str]]:
+        """Lightweight {doc_id: {name, sha, collection, indexed}} in insertion order (no text, no summaries)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT doc_id, name, sha, collection, indexed FROM docs ORDER BY created"
+            ).fetchall()
+        return {r["doc_id"]: {"name": r["name"], "sha": r["sha"], "collection": r["collection"],
+                              "indexed": bool(r["indexed"])}
+                for r in rows}
+
+    def get(self, doc_id: str) -> Optional[Dict[str, str]]:
+        """Document record without its text."""
+        with self._lock:
+            r = self._db.execute(
+                "SELECT doc_id, name, path, sha, summary, keys, collection, indexed FROM docs WHERE doc_id = ?",
+                (doc_id,)
+            ).fetchone()
+        return dict(r) if r else None
+
+    def get_pages(self, doc_id: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT text FROM pages WHERE doc_id = ? ORDER BY page_no", (doc_id,)
+            ).fetchall()
+        return [r["text"] for r in rows]
+
+    def get_text(self, doc_id: str) -> str:
+        return "\n".join(self.get_pages(doc_id))
+
+    def iter_index_docs(self, doc_ids: Iterable[str]) -> Iterator[Dict[str, str]]:
+        """Lazily yield `build_or_update_index` inputs, one document text at a time."""
+        for did in doc_ids:
+            info = self.get(did)
+            if info is not None:
+                yield {"doc_id": did, "text": self.get_text(did),
+                       "source_path": info["path"], "name": info["name"]}
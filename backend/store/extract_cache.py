@@ -0,0 +1,69 @@
+# backend/store/extract_cache.py
+import gzip
+import json
+import os
+import tempfile
+from typing import List, Optional
+
+class ExtractCache:
+    """
+    On-disk cache of extracted page text.
+
+    One gzip'd JSON list of page strings per (content hash, extractor version).
+    Hits refresh the file mtime; once the directory grows past `max_bytes` the
+    least recently used entries are evicted.
+    """
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, content_hash: str, version: str) -> str:
+        return os.path.join(self.root, f"{content_hash}-v{version}.json.gz")
+
+    def get(self, content_hash: str, version: str) -> Optional[List[str]]:
+        path = self._path(content_hash, version)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                pages = json.load(f)
+            os.utime(path)          # LRU touch
+            return pages
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):   # truncated / corrupt entry -> treat as miss
+            try: os.remove(path)
+            except OSError: pass
+            return None
+
+    def put(self, content_hash: str, version: str, pages: List[str]):
+        path = self._path(content_hash, version)
+        # unique temp per writer: identical files parsed concurrently race on the same entry
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8", compresslevel=6) as f:
+                json.dump(pages, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for fn in os.listdir(self.root):
+            if not fn.endswith(".json.gz"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.root, fn))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fn))
+        total = sum(size for _, size, _ in entries)
+        for _, size, fn in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root, fn))
+                total -= size
+            except FileNotFoundError:
+                pass
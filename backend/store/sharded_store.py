@@ -0,0 +1,114 @@
+# backend/store/sharded_store.py
+import heapq
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+from backend.store.vector_store import VectorStore
+
+class ShardedStore:
+    """
+    Named collections, one VectorStore shard each.
+
+    Shards are opened lazily through `opener(name)` (None -> collection has no
+    index yet) and can be loaded/unloaded independently; a shard loads under its own
+    lock, so searches on other shards aren't blocked meanwhile. Loaded shards are
+    refreshed when another process has committed to them. Searches fan out over the
+    selected shards on a thread pool (FAISS releases the GIL) and merge top-k by score.
+    """
+    def __init__(self, opener: Callable[[str], Optional[VectorStore]], max_workers: int = 4):
+        self._opener = opener
+        self._shards: Dict[str, VectorStore] = {}
+        self._lock = threading.Lock()
+        self._opening: Dict[str, threading.Lock] = {}   # per-name load locks
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-search")
+
+    def get(self, name: str) -> Optional[VectorStore]:
+        with self._lock:
+            vs = self._shards.get(name)
+            opening = self._opening.setdefault(name, threading.Lock())
+        if vs is not None:
+            vs.refresh()
+            return vs
+        with opening:
+            with self._lock:
+                vs = self._shards.get(name)
+            if vs is None:
+                vs = self._opener(name)         # disk I/O outside the store-wide lock
+                if vs is not None:
+                    with self._lock:
+                        self._shards[name] = vs
+            return vs
+
+    load = get
+
+    def attach(self, name: str, vs: VectorStore):
+        """Register an already-open shard (e.g. the one a build just wrote)."""
+        with self._lock:
+            self._shards[name] = vs
+
+    def unload(self, name: str):
+        with self._lock:
+            self._shards.pop(name, None)
+
+    def unload_all(self):
+        with self._lock:
+            self._shards.clear()
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._shards)
+
+    def view(self, names: Iterable[str]) -> "ShardView":
+        return ShardView(self, list(names))
+
+    def _fan_out(self, names: Iterable[str], fn, k: int):
+        """Run fn(shard) on every selected shard in parallel; merge top-k (score, ...) tuples."""
+        shards = [vs for vs in (self.get(n) for n in names) if vs is not None]
+        if not shards:
+            return []
+        if len(shards) == 1:
+            return fn(shards[0])
+        parts = self._pool.map(fn, shards)
+        return heapq.nlargest(k, (h for part in parts for h in part), key=lambda h: h[0])
+
+    def search(self, query_vec, k: int = 5, names: Iterable[str] = (), doc_ids=None):
+        return self._fan_out(names, lambda vs: vs.search(query_vec, k=k, doc_ids=doc_ids), k)
+
+    def top_docs(self, query_vec, n: int = 8, names: Iterable[str] = ()):
+        return self._fan_out(names, lambda vs: vs.top_docs(query_vec, n=n), n)
+
+    def vectors_for(self, metas, names: Iterable[str] = ()) -> Optional[np.ndarray]:
+        """Stored vectors for search hits; None if a hit's shard no longer holds it (re-embed instead)."""
+        out = [None] * len(metas)
+        for vs in (self.get(n) for n in names):
+            if vs is None:
+                continue
+            idx = [i for i, m in enumerate(metas) if out[i] is None and vs.owns(m)]
+            if idx:
+                vecs = vs.vectors_for([metas[i] for i in idx])
+                if vecs is None:
+                    return None
+                for i, v in zip(idx, vecs):
+                    out[i] = v
+        if any(v is None for v in out):     # shard unloaded/reloaded since the search
+            return None
+        return np.vstack(out) if metas else np.zeros((0, 0), dtype="float32")
+
+class ShardView:
+    """The VectorStore-like surface (`len`, `search`, `top_docs`, `vectors_for`) over a selection of collections."""
+    def __init__(self, store: ShardedStore, names: List[str]):
+        self.store = store
+        self.names = names
+
+    def __len__(self):
+        return sum(len(vs) for vs in (self.store.get(n) for n in self.names) if vs is not None)
+
+    def search(self, query_vec, k: int = 5, doc_ids=None):
+        return self.store.search(query_vec, k=k, names=self.names, doc_ids=doc_ids)
+
+    def top_docs(self, query_vec, n: int = 8):
+        return self.store.top_docs(query_vec, n=n, names=self.names)
+
+    def vectors_for(self, metas) -> Optional[np.ndarray]:
+        return self.store.vectors_for(metas, names=self.names)
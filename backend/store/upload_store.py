@@ -0,0 +1,60 @@
+# backend/store/upload_store.py
+import os
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+from backend.store.cache import load_json, save_json_durable
+from backend.utils.dedupe import file_hash_stream
+
+class UploadStore:
+    """
+    Content-addressed upload storage.
+
+    Bytes live once under `<root>/objects/<sha256><ext>`; `catalog.json` maps each
+    original file name to the hash of its latest content. Uploads are streamed to
+    disk in fixed-size blocks while hashing, so memory stays bounded and identical
+    content is detected before anything is parsed or embedded.
+    """
+    def __init__(self, root: str, block_size: int = 1 << 20):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.catalog_path = os.path.join(root, "catalog.json")
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        cat = load_json(self.catalog_path, {}) or {}
+        self.names: Dict[str, str] = cat.get("names", {})       # file name -> sha256
+        self.objects: Dict[str, str] = cat.get("objects", {})   # sha256 -> object file name
+
+    def _save_catalog(self):
+        tmp = self.catalog_path + ".tmp"
+        save_json_durable(tmp, {"names": self.names, "objects": self.objects})
+        os.replace(tmp, self.catalog_path)
+
+    def path_for(self, sha: str) -> Optional[str]:
+        fn = self.objects.get(sha)
+        return os.path.join(self.objects_dir, fn) if fn else None
+
+    def lookup(self, name: str) -> Optional[str]:
+        return self.names.get(name)
+
+    def put_stream(self, name: str, fobj) -> Tuple[str, str, bool]:
+        """
+        Stream `fobj` into the store under `name`.
+        Returns (object_path, sha256, is_new_content).
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.objects_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                sha = file_hash_stream(fobj, sink=out, block_size=self.block_size)
+            with self._lock:
+                is_new = self.path_for(sha) is None or not os.path.exists(self.path_for(sha))
+                if is_new:
+                    self.objects[sha] = sha + os.path.splitext(name)[1].lower()
+                    os.replace(tmp, self.path_for(sha))
+                self.names[name] = sha
+                self._save_catalog()
+            return self.path_for(sha), sha, is_new
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
@@ -1,43 +1,476 @@
 import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
 import faiss
 import numpy as np
-from backend.store.cache import save_json, load_json
+from backend.store.cache import load_json, write_bytes_durable, file_lock
+from backend.utils.dedupe import NearDupIndex, minhash_signature, file_hash_path
+
+# Two-stage retrieval: each doc gets a centroid vector plus one vector per run of
+# SECTION_CHUNKS consecutive chunks; `top_docs()` ranks docs on these before chunk search.
+SECTION_CHUNKS = int(os.getenv("SECTION_CHUNKS", "4"))
+
+class _RWLock:
+    """Shared readers / one exclusive writer (re-entrant for the writer, writers preferred)."""
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None         # owning thread ident
+        self._depth = 0
+        self._waiting = 0           # writers queued -> new readers wait
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self._cond:
+            nested = self._writer == me
+            if not nested:
+                while self._writer is not None or self._waiting:
+                    self._cond.wait()
+                self._readers += 1
+        try:
+            yield
+        finally:
+            if not nested:
+                with self._cond:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._waiting += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting -= 1
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._cond.notify_all()
 
 class VectorStore:
+    """
+    FAISS wrapper with stable chunk IDs.
+
+    Vectors live in an IndexIDMap2 so every chunk keeps its `chunk_id` for life.
+    Deletes only tombstone metadata (`deleted: True`); `compact()` later drops the
+    tombstoned vectors from the index and rewrites index + metadata.
+    `near_dup` holds MinHash signatures of live chunks and is saved in meta.json.
+
+    A chunk can stand for several documents: `doc_id`/`name`/`source_path`/`hash`
+    describe its primary document, and `aliases` ({doc_id: {hash, name, source_path}})
+    records other documents whose identical or near-duplicate chunk was skipped in
+    its favour. Aliased documents see the chunk in their scope and doc vectors;
+    `release()` drops one document's reference and only tombstones the chunk once
+    nobody refers to it (an alias is promoted to primary when the primary leaves).
+
+    `save()` commits index + metadata as a pair: both are written to `.tmp` files
+    and fsynced, then renamed index-first. meta.json records the SHA-256 of the
+    index it belongs to, so `load()` can roll an interrupted commit forward.
+    Commits and recovery hold `<index>.lock`, so another process never sees (or
+    deletes) a half-written commit. Mutations (builds, deletes, compaction) run in
+    `writing()`: one writer at a time across threads and processes, and a store whose
+    files were committed by another process since it was loaded is reloaded first.
+
+    Document-level vectors (centroid + sections, see SECTION_CHUNKS) are derived
+    from the chunk vectors whenever a doc's chunks change and back `top_docs()`.
+
+    In-process, searches share a reader/writer lock (FAISS releases the GIL, so
+    concurrent queries on one shard run in parallel); only in-memory mutations and
+    reloads take it exclusively. `save()` snapshots under the shared lock and does the
+    file I/O (fsync) without it, so compaction doesn't stall searches.
+    """
     def __init__(self, index_path: str, meta_path: str, dim: int):
         self.index_path = index_path
         self.meta_path  = meta_path
         self.dim = dim
         self.index = None
-        self.meta  = []
+        self.meta  = []         # list of chunk metadata dicts (each has "chunk_id")
+        self.next_id = 0
+        self._by_id = {}        # chunk_id -> metadata dict
+        self._n_dead = 0        # tombstoned chunks still present in the index
+        self.near_dup = NearDupIndex()
+        self._doc_chunks = {}   # doc_id -> live chunk_ids it refers to (primary or alias), in order
+        self._doc_vecs = {}     # doc_id -> [centroid; section vectors] (normalized rows)
+        self._stage1 = None     # cached (doc_ids, stacked doc vectors, owner row -> doc index)
+        self._rw = _RWLock()    # searches share it; mutations and reloads take it exclusively
+        self._save_lock = threading.Lock()      # one commit at a time (snapshot + write in order)
+        self._compactor_lock = threading.Lock()
+        self._compactor = None
+        self._write_lock = threading.RLock()
+        self._writers = 0       # writing() nesting depth in this process
+        self._disk_stamp = None # stat of meta.json as last loaded/saved by this instance
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.meta_path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def writing(self):
+        """Single-writer session; reloads first if another process committed since our last load/save."""
+        with self._write_lock:
+            if self._writers:
+                self._writers += 1
+                try:
+                    yield self
+                finally:
+                    self._writers -= 1
+                return
+            with file_lock(self.index_path + ".write.lock"):
+                self._writers = 1
+                try:
+                    if self.index is None or self._stamp() != self._disk_stamp:
+                        self.load()
+                    yield self
+                finally:
+                    self._writers = 0
+
+    def _new_index(self):
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))  # cosine via L2-normalize
+
+    def _upgrade_legacy(self, flat):
+        """Positional IndexFlatIP -> IndexIDMap2, using the old positions as chunk IDs."""
+        self.dim = flat.d
+        index = self._new_index()
+        if flat.ntotal:
+            vecs = flat.reconstruct_n(0, flat.ntotal)
+            index.add_with_ids(vecs, np.arange(flat.ntotal, dtype="int64"))
+        for i, m in enumerate(self.meta):
+            m.setdefault("chunk_id", i)
+        return index
+
+    def _recover(self):
+        """Finish (or discard) a commit that was interrupted between the two renames."""
+        idx_tmp, meta_tmp = self.index_path + ".tmp", self.meta_path + ".tmp"
+        if os.path.exists(meta_tmp):
+            try:
+                want = (load_json(meta_tmp, {}) or {}).get("index_sha256")
+            except ValueError:          # truncated meta tmp -> commit never reached the renames
+                want = None
+            if want and os.path.exists(idx_tmp) and file_hash_path(idx_tmp) == want:
+                os.replace(idx_tmp, self.index_path)
+                os.replace(meta_tmp, self.meta_path)
+            elif want and os.path.exists(self.index_path) and file_hash_path(self.index_path) == want:
+                os.replace(meta_tmp, self.meta_path)
+        for tmp in (idx_tmp, meta_tmp):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def refresh(self) -> bool:
+        """Reload if another process committed since our last load/save (no-op while we write)."""
+        if self._writers or self.index is None or self._stamp() == self._disk_stamp:
+            return False
+        with self._write_lock:
+            if self._stamp() != self._disk_stamp:
+                self.load()
+        return True
 
     def load(self):
-        if os.path.exists(self.index_path):
-            self.index = faiss.read_index(self.index_path)
-            self.meta  = load_json(self.meta_path, [])
-        else:
-            self.index = faiss.IndexFlatIP(self.dim)  # cosine via L2-normalize
-            self.meta  = []
-
-    def add(self, vectors, metadatas):
+        with file_lock(self.index_path + ".lock"):
+            self._recover()
+            exists = os.path.exists(self.index_path)
+            if exists:
+                index = faiss.read_index(self.index_path)
+                raw = load_json(self.meta_path, [])
+            stamp = self._stamp()
+        with self._rw.write():
+            self._disk_stamp = stamp
+            if exists:
+                if isinstance(raw, list):           # legacy: bare list of chunk dicts
+                    self.meta, next_id, sigs = raw, None, {}
+                else:
+                    self.meta, next_id = raw.get("chunks", []), raw.get("next_id")
+                    sigs = raw.get("near_dup", {})
+                if not isinstance(index, faiss.IndexIDMap2):
+                    index = self._upgrade_legacy(index)
+                self.index = index
+                self.dim = index.d
+                self._by_id = {int(m["chunk_id"]): m for m in self.meta}
+                self._n_dead = sum(1 for m in self.meta if m.get("deleted"))
+                self.next_id = next_id if next_id is not None else max(self._by_id, default=-1) + 1
+                self.near_dup = NearDupIndex()
+                for m in self.live_chunks():
+                    cid = m["chunk_id"]
+                    sig = sigs.get(str(cid)) or minhash_signature(m.get("text", ""))
+                    self.near_dup.add(cid, sig)
+                self._doc_chunks = {}
+                for m in self.live_chunks():
+                    for did in self._refs(m):
+                        self._doc_chunks.setdefault(did, []).append(int(m["chunk_id"]))
+                self._doc_vecs = {}
+                self._refresh_doc_vectors(list(self._doc_chunks))
+            else:
+                self.index = self._new_index()
+                self.meta  = []
+                self._by_id = {}
+                self._n_dead = 0
+                self.next_id = 0
+                self.near_dup = NearDupIndex()
+                self._doc_chunks = {}
+                self._doc_vecs = {}
+                self._stage1 = None
+
+    def add(self, vectors, metadatas, signatures=None):
+        """Append vectors; `signatures` (MinHash, one per item) feed the near-dup index."""
         arr = np.array(vectors, dtype="float32")
         faiss.normalize_L2(arr)
-        self.index.add(arr)
-        self.meta.extend(metadatas)
+        with self._rw.write():
+            ids = np.arange(self.next_id, self.next_id + len(metadatas), dtype="int64")
+            self.index.add_with_ids(arr, ids)
+            for cid, m in zip(ids, metadatas):
+                m["chunk_id"] = int(cid)
+                self._by_id[int(cid)] = m
+            for cid, sig in zip(ids, signatures or []):
+                self.near_dup.add(int(cid), sig)
+            touched = set()
+            for cid, m in zip(ids, metadatas):
+                for did in self._refs(m):
+                    self._doc_chunks.setdefault(did, []).append(int(cid))
+                    touched.add(did)
+            self.meta.extend(metadatas)
+            self.next_id += len(metadatas)
+            self._refresh_doc_vectors(touched)
+            return [int(i) for i in ids]
 
     def save(self):
-        faiss.write_index(self.index, self.index_path)
-        save_json(self.meta_path, self.meta)
+        with self._save_lock:
+            with self._rw.read():           # consistent snapshot; searches keep running
+                buf = faiss.serialize_index(self.index).tobytes()
+                payload = json.dumps({
+                    "index_sha256": hashlib.sha256(buf).hexdigest(),
+                    "next_id": self.next_id,
+                    "chunks": self.meta,
+                    "near_dup": self.near_dup.to_json(),
+                }, ensure_ascii=False).encode("utf-8")
+            idx_tmp, meta_tmp = self.index_path + ".tmp", self.meta_path + ".tmp"
+            with file_lock(self.index_path + ".lock"):
+                write_bytes_durable(idx_tmp, buf)
+                write_bytes_durable(meta_tmp, payload)
+                os.replace(idx_tmp, self.index_path)
+                os.replace(meta_tmp, self.meta_path)
+                self._disk_stamp = self._stamp()
+
+    # ---------- deletes / compaction ----------
+    def live_chunks(self, doc_id: str | None = None):
+        if doc_id is not None:
+            return [self._by_id[c] for c in self._doc_chunks.get(doc_id, [])]
+        return [m for m in self.meta if not m.get("deleted")]
+
+    def doc_ids(self):
+        return list(self._doc_chunks)
 
-    def search(self, query_vec, k=5):
+    # ---------- shared chunks (aliases) ----------
+    @staticmethod
+    def _refs(meta):
+        return [meta.get("doc_id"), *meta.get("aliases", {})]
+
+    @staticmethod
+    def doc_ref(meta, doc_id: str):
+        """{hash, name, source_path} of `doc_id`'s reference to this chunk (None if it has none)."""
+        if meta.get("doc_id") == doc_id:
+            return {"hash": meta.get("hash"), "name": meta.get("name"), "source_path": meta.get("source_path")}
+        return meta.get("aliases", {}).get(doc_id)
+
+    def ref_index(self):
+        """{hash: chunk_id} for every live reference (primary and alias hashes)."""
+        with self._rw.read():
+            out = {}
+            for m in self.live_chunks():
+                for did in self._refs(m):
+                    out[self.doc_ref(m, did)["hash"]] = int(m["chunk_id"])
+            return out
+
+    def has_ref(self, chunk_id: int, ref_hash: str) -> bool:
+        """True while `chunk_id` is live and still stands for a chunk with `ref_hash`."""
+        m = self._by_id.get(int(chunk_id))
+        return (m is not None and not m.get("deleted")
+                and any(self.doc_ref(m, d)["hash"] == ref_hash for d in self._refs(m)))
+
+    def alias(self, chunk_id: int, doc_id: str, ref) -> bool:
+        """Let `doc_id` share a live chunk; `ref` = {hash, name, source_path} of its own chunk."""
+        with self._rw.write():
+            m = self._by_id.get(int(chunk_id))
+            if m is None or m.get("deleted") or doc_id in self._refs(m):
+                return False
+            m.setdefault("aliases", {})[doc_id] = dict(ref)
+            self._doc_chunks.setdefault(doc_id, []).append(int(chunk_id))
+            self._refresh_doc_vectors([doc_id])
+            return True
+
+    def release(self, doc_id: str, chunk_ids) -> int:
+        """
+        Drop `doc_id`'s reference to the given chunks. Chunks nobody else refers to are
+        tombstoned; if the primary leaves, the first alias becomes primary. Returns #released.
+        """
+        n, dead = 0, []
+        with self._rw.write():
+            for cid in chunk_ids:
+                m = self._by_id.get(int(cid))
+                if m is None or m.get("deleted") or doc_id not in self._refs(m):
+                    continue
+                n += 1
+                aliases = m.get("aliases", {})
+                if aliases.pop(doc_id, None) is None:          # primary leaves
+                    if not aliases:
+                        dead.append(int(cid))
+                        continue
+                    heir = next(iter(aliases))
+                    m.update(doc_id=heir, **aliases.pop(heir))
+                if not aliases:
+                    m.pop("aliases", None)
+            if doc_id in self._doc_chunks:
+                gone = {int(c) for c in chunk_ids}
+                live = [c for c in self._doc_chunks[doc_id] if c not in gone]
+                if live:
+                    self._doc_chunks[doc_id] = live
+                else:
+                    self._doc_chunks.pop(doc_id, None)
+            self.delete_chunks(dead)
+            self._refresh_doc_vectors([doc_id])
+        return n
+
+    def delete_chunks(self, chunk_ids) -> int:
+        """
+        Tombstone chunks by ID for every document referring to them (see `release()`
+        to drop a single document). Vectors stay in the index until `compact()`.
+        """
+        n, touched = 0, set()
+        with self._rw.write():
+            for cid in chunk_ids:
+                m = self._by_id.get(int(cid))
+                if m is not None and not m.get("deleted"):
+                    m["deleted"] = True
+                    self.near_dup.remove(int(cid))
+                    touched.update(self._refs(m))
+                    n += 1
+            self._n_dead += n
+            for did in touched:
+                live = [c for c in self._doc_chunks.get(did, []) if not self._by_id[c].get("deleted")]
+                if live:
+                    self._doc_chunks[did] = live
+                else:
+                    self._doc_chunks.pop(did, None)
+            self._refresh_doc_vectors(touched)
+        return n
+
+    def delete_doc(self, doc_id: str) -> int:
+        """Remove a document; chunks still shared with other documents stay live for them."""
+        with self._rw.write():
+            return self.release(doc_id, [m["chunk_id"] for m in self.live_chunks(doc_id)])
+
+    def tombstone_ratio(self) -> float:
+        return self._n_dead / len(self.meta) if self.meta else 0.0
+
+    def compact(self) -> int:
+        """Drop tombstoned vectors from the index, rewrite index + metadata. Returns #removed."""
+        with self.writing():
+            with self._rw.write():
+                dead = [m["chunk_id"] for m in self.meta if m.get("deleted")]
+                if not dead:
+                    return 0
+                self.index.remove_ids(np.array(dead, dtype="int64"))
+                self.meta = [m for m in self.meta if not m.get("deleted")]
+                self._by_id = {int(m["chunk_id"]): m for m in self.meta}
+                self._n_dead = 0
+            self.save()                     # serialize + fsync outside the exclusive lock
+            return len(dead)
+
+    def compact_in_background(self):
+        """Run `compact()` on a daemon thread (at most one at a time)."""
+        with self._compactor_lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return self._compactor
+            self._compactor = threading.Thread(target=self.compact, name="faiss-compact", daemon=True)
+            self._compactor.start()
+            return self._compactor
+
+    # ---------- document-level vectors ----------
+    def _refresh_doc_vectors(self, doc_ids):
+        """Recompute centroid + section vectors for `doc_ids` from their stored chunk vectors."""
+        for did in doc_ids:
+            cids = self._doc_chunks.get(did)
+            if not cids:
+                self._doc_vecs.pop(did, None)
+                continue
+            V = self.index.reconstruct_batch(np.array(cids, dtype="int64"))
+            rows = [V.mean(axis=0)]
+            if len(cids) > SECTION_CHUNKS:
+                rows += [V[i:i + SECTION_CHUNKS].mean(axis=0) for i in range(0, len(cids), SECTION_CHUNKS)]
+            R = np.vstack(rows).astype("float32")
+            faiss.normalize_L2(R)
+            self._doc_vecs[did] = R
+        self._stage1 = None
+
+    def top_docs(self, query_vec, n: int = 8):
+        """Stage 1: [(score, doc_id)] for the n docs whose centroid/section vectors best match."""
+        q = np.array(query_vec, dtype="float32")
+        q /= (np.linalg.norm(q) + 1e-9)
+        with self._rw.read():
+            if not self._doc_vecs:
+                return []
+            if self._stage1 is None:
+                docs = list(self._doc_vecs)
+                mats = [self._doc_vecs[d] for d in docs]
+                owner = np.concatenate([np.full(len(m), i) for i, m in enumerate(mats)])
+                self._stage1 = (docs, np.vstack(mats), owner)
+            docs, M, owner = self._stage1
+        best = np.full(len(docs), -np.inf, dtype="float32")
+        np.maximum.at(best, owner, M @ q)
+        top = np.argsort(-best)[:n]
+        return [(float(best[i]), docs[i]) for i in top]
+
+    def owns(self, meta) -> bool:
+        return self._by_id.get(meta.get("chunk_id")) is meta
+
+    def vectors_for(self, metas):
+        """Stored (normalized) vectors for chunk metadata returned by `search()`; None if any is gone."""
+        with self._rw.read():
+            if not all(self.owns(m) for m in metas):     # compacted or reloaded since the search
+                return None
+            return self.index.reconstruct_batch(np.array([m["chunk_id"] for m in metas], dtype="int64"))
+
+    # ---------- search ----------
+    def __len__(self):
+        return len(self.meta) - self._n_dead if self.index is not None else 0
+
+    def search(self, query_vec, k=5, doc_ids=None):
+        """Top-k live chunks; `doc_ids` restricts the scan to those documents' chunks."""
         if self.index is None or self.index.ntotal == 0:
             return []
         q = np.array([query_vec], dtype="float32")
         faiss.normalize_L2(q)
-        D, I = self.index.search(q, k)
-        out = []
-        for score, idx in zip(D[0], I[0]):
-            if idx == -1:
-                continue
-            out.append((float(score), self.meta[idx]))
-        return out
+        with self._rw.read():
+            if doc_ids is not None:
+                ids = [c for d in doc_ids for c in self._doc_chunks.get(d, [])]
+                if not ids:
+                    return []
+                sel = faiss.IDSelectorBatch(np.array(ids, dtype="int64"))
+                D, I = self.index.search(q, min(k, len(ids)), params=faiss.SearchParameters(sel=sel))
+            else:
+                # over-fetch so tombstoned hits don't starve the top-k
+                D, I = self.index.search(q, min(k + self._n_dead, self.index.ntotal))
+            out = []
+            for score, idx in zip(D[0], I[0]):
+                if idx == -1:
+                    continue
+                m = self._by_id.get(int(idx))
+                if m is None or m.get("deleted"):
+                    continue
+                out.append((float(score), m))
+                if len(out) >= k:
+                    break
+            return out
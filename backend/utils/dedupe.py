@@ -1,5 +1,7 @@
 # backend/utils/dedupe.py
 import hashlib, re
+from typing import Dict, Hashable, List, Optional
+import numpy as np
 
 def normalize_text(t: str) -> str:
     t = t.lower()
@@ -11,3 +13,98 @@ def chunk_hash(text: str) -> str:
 
 def file_hash_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
+
+def file_hash_stream(fobj, sink=None, block_size: int = 1 << 20) -> str:
+    """
+    Same digest as `file_hash_bytes(fobj.read())`, read in fixed-size blocks.
+    If `sink` is given, every block is also written to it (hash + copy in one pass).
+    """
+    h = hashlib.sha256()
+    for block in iter(lambda: fobj.read(block_size), b""):
+        h.update(block)
+        if sink is not None:
+            sink.write(block)
+    return h.hexdigest()
+
+def file_hash_path(path: str, block_size: int = 1 << 20) -> str:
+    with open(path, "rb") as f:
+        return file_hash_stream(f, block_size=block_size)
+
+# ---------- Near-duplicates (MinHash + LSH) ----------
+MINHASH_PERM  = 64
+MINHASH_BANDS = 16          # 16 bands x 4 rows -> candidate pairs from ~0.5 Jaccard up
+SHINGLE_WORDS = 5
+_MH_PRIME = 4294967311      # smallest prime > 2**32, so a*h+b stays inside uint64
+
+_rng = np.random.default_rng(1)
+_MH_A = _rng.integers(1, 2**32, size=MINHASH_PERM, dtype=np.uint64)
+_MH_B = _rng.integers(0, 2**32, size=MINHASH_PERM, dtype=np.uint64)
+
+def _shingles(text: str, n: int = SHINGLE_WORDS) -> set:
+    words = normalize_text(text).split()
+    if len(words) <= n:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+def minhash_signature(text: str) -> List[int]:
+    """MinHash over word 5-gram shingles (normalized like `chunk_hash`)."""
+    hv = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+         for s in _shingles(text)],
+        dtype=np.uint64,
+    )
+    perm = (np.outer(hv, _MH_A) + _MH_B) % np.uint64(_MH_PRIME)
+    return perm.min(axis=0).tolist()
+
+def minhash_similarity(a: List[int], b: List[int]) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(np.asarray(a) == np.asarray(b)))
+
+class NearDupIndex:
+    """
+    LSH index over MinHash signatures. Candidates come from band collisions and
+    are confirmed by estimated Jaccard >= threshold.
+    """
+    def __init__(self, bands: int = MINHASH_BANDS):
+        self.bands = bands
+        self.rows  = MINHASH_PERM // bands
+        self.sigs: Dict[Hashable, List[int]] = {}
+        self._buckets: Dict[tuple, set] = {}
+
+    def _band_keys(self, sig: List[int]):
+        for b in range(self.bands):
+            yield (b, tuple(sig[b * self.rows:(b + 1) * self.rows]))
+
+    def add(self, key: Hashable, sig: List[int]):
+        self.sigs[key] = sig
+        for bk in self._band_keys(sig):
+            self._buckets.setdefault(bk, set()).add(key)
+
+    def remove(self, key: Hashable):
+        sig = self.sigs.pop(key, None)
+        if sig is None:
+            return
+        for bk in self._band_keys(sig):
+            keys = self._buckets.get(bk)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bk]
+
+    def query(self, sig: List[int], threshold: float) -> Optional[Hashable]:
+        """Key of the first stored signature with similarity >= threshold, else None."""
+        seen = set()
+        for bk in self._band_keys(sig):
+            for key in self._buckets.get(bk, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                if minhash_similarity(sig, self.sigs[key]) >= threshold:
+                    return key
+        return None
+
+    def __len__(self):
+        return len(self.sigs)
+
+    def to_json(self) -> Dict[str, List[int]]:
+        return {str(k): v for k, v in self.sigs.items()}
@@ -1,7 +1,12 @@
 import os
+from typing import List
 from pypdf import PdfReader
 from docx import Document
 
+from backend.settings import EXTRACT_CACHE_DIR, EXTRACT_CACHE_MAX_MB
+from backend.store.extract_cache import ExtractCache
+from backend.utils.dedupe import file_hash_path
+
 # Optional OCR imports (only used if installed)
 try:
     from pdf2image import convert_from_path
@@ -11,41 +16,91 @@ try:
 except Exception:
     OCR_AVAILABLE = False
 
-def load_text_from_path(path: str) -> str:
+# Bump whenever extraction output changes, so stale cache entries are ignored.
+EXTRACTOR_VERSION = "2"
+
+# Per-page OCR: pages with less extractable text than this get OCR'd, rendered at a
+# DPI that puts the long page side near OCR_TARGET_PX (clamped to the DPI range).
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "50"))
+OCR_TARGET_PX      = int(os.getenv("OCR_TARGET_PX", "3300"))   # ~ US Letter at 300 DPI
+OCR_MIN_DPI        = int(os.getenv("OCR_MIN_DPI", "150"))
+OCR_MAX_DPI        = int(os.getenv("OCR_MAX_DPI", "300"))
+
+_cache = None
+def _get_cache() -> ExtractCache:
+    global _cache
+    if _cache is None:
+        _cache = ExtractCache(EXTRACT_CACHE_DIR, EXTRACT_CACHE_MAX_MB * 1024 * 1024)
+    return _cache
+
+def load_pages_from_path(path: str, use_cache: bool = True) -> List[str]:
+    """
+    Extracted text per page (one entry for non-paginated formats).
+    Results are cached by file content hash + EXTRACTOR_VERSION, so re-processing
+    identical bytes skips parsing and OCR.
+    """
+    version = f"{EXTRACTOR_VERSION}-ocr{OCR_MIN_PAGE_CHARS}" if OCR_AVAILABLE else EXTRACTOR_VERSION
+    key = file_hash_path(path) if use_cache else None
+    if key:
+        pages = _get_cache().get(key, version)
+        if pages is not None:
+            return pages
+    pages = _extract_pages(path)
+    if key:
+        _get_cache().put(key, version, pages)
+    return pages
+
+def load_text_from_path(path: str, use_cache: bool = True) -> str:
+    return "\n".join(load_pages_from_path(path, use_cache=use_cache))
+
+def _extract_pages(path: str) -> List[str]:
     ext = os.path.splitext(path)[1].lower()
     if ext == ".pdf":
-        txt = _pdf_to_text(path)
-        if len(txt.strip()) < 200 and OCR_AVAILABLE:
-            ocr_txt = _pdf_to_text_ocr(path)
-            if len(ocr_txt.strip()) > len(txt.strip()):
-                return ocr_txt
-        return txt
+        return _pdf_to_pages(path)
     if ext in (".docx", ".doc"):
-        return _docx_to_text(path)
+        return [_docx_to_text(path)]
     if ext in (".txt", ".md"):
         with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
+            return [f.read()]
     if ext in (".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff") and OCR_AVAILABLE:
-        return _image_ocr(path)
+        return [_image_ocr(path)]
     raise ValueError(f"Unsupported file type or OCR not available: {ext}")
 
-def _pdf_to_text(path: str) -> str:
+def _pdf_to_pages(path: str) -> List[str]:
+    """Text layer per page; only near-empty (scanned) pages fall back to OCR."""
     reader = PdfReader(path)
-    parts = []
-    for p in reader.pages:
-        parts.append(p.extract_text() or "")
-    return "\n".join(parts)
+    out = []
+    for i, page in enumerate(reader.pages):
+        txt = page.extract_text() or ""
+        if OCR_AVAILABLE and len(txt.strip()) < OCR_MIN_PAGE_CHARS:
+            ocr_txt = _pdf_page_ocr(path, i + 1, _adaptive_dpi(page))
+            if len(ocr_txt.strip()) > len(txt.strip()):
+                txt = ocr_txt
+        out.append(txt)
+    return out
+
+def _adaptive_dpi(page) -> int:
+    """DPI so the page's long side renders at ~OCR_TARGET_PX (mediabox is in 1/72 in)."""
+    try:
+        long_in = max(float(page.mediabox.width), float(page.mediabox.height)) / 72.0
+    except Exception:
+        long_in = 0.0
+    if long_in <= 0:
+        return OCR_MAX_DPI
+    return int(min(OCR_MAX_DPI, max(OCR_MIN_DPI, OCR_TARGET_PX / long_in)))
 
 def _docx_to_text(path: str) -> str:
     doc = Document(path)
     return "\n".join(p.text for p in doc.paragraphs if p.text.strip())
 
-def _pdf_to_text_ocr(path: str, dpi: int = 300, lang: str = "eng") -> str:
-    pages = convert_from_path(path, dpi=dpi)
-    out = []
-    for img in pages:
-        out.append(pytesseract.image_to_string(img, lang=lang))
-    return "\n".join(out)
+def _pdf_page_ocr(path: str, page_no: int, dpi: int = 300, lang: str = "eng") -> str:
+    """Rasterize and OCR a single 1-based page, so only one page image is in memory."""
+    images = convert_from_path(path, dpi=dpi, first_page=page_no, last_page=page_no)
+    try:
+        return "\n".join(pytesseract.image_to_string(img, lang=lang) for img in images)
+    finally:
+        for img in images:
+            img.close()
 
 def _image_ocr(path: str, lang: str = "eng") -> str:
     img = Image.open(path)
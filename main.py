@@ -1,6 +1,211 @@
-def main():
-    print("Hello from document-classification-chatbot!")
+"""
+DocuChat command line.
+
+  python main.py index data/uploads --workers 4 --prune --collection team-a
+  python main.py ask questions.csv --out answers.jsonl --workers 4 --collection team-a
+
+`index` walks a directory tree, parses files on a bounded thread pool, records them
+in the shared document store and streams them into `build_or_update_index`
+(checkpointed, so an interrupted run resumes).
+`ask` answers a CSV (column `question`, optional `id`) or JSONL file of questions
+through `route_and_answer` and writes answers, sources and per-question timings.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator
+
+from tqdm import tqdm
+
+SUPPORTED_EXTS = {".pdf", ".docx", ".doc", ".txt", ".md"}
+
+
+def bounded_map(fn: Callable, items: Iterable, workers: int) -> Iterator:
+    """
+    Like `executor.map`, but keeps at most 2*workers items in flight, so results
+    stream out in input order while memory stays bounded.
+    """
+    window = max(1, workers * 2)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        pending = deque()
+        for item in items:
+            pending.append(ex.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# -------------------- index --------------------
+def _iter_files(root: str) -> Iterator[str]:
+    """
+    Supported files under `root` as absolute paths (independent of the cwd / how ROOT was spelled).
+    The app's content-addressed upload store (`objects/` next to `catalog.json`) is skipped,
+    so `index data/uploads` doesn't re-index uploads under their hash names.
+    """
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(root)):
+        if "catalog.json" in filenames:
+            dirnames[:] = [d for d in dirnames if d != "objects"]
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if os.path.splitext(fn)[1].lower() in SUPPORTED_EXTS:
+                yield os.path.join(dirpath, fn)
+
+
+def _doc_id_for(path: str, collection: str = "default") -> str:
+    """
+    Stable per-(collection, file) id: re-indexing a revised file replaces its old chunks,
+    and indexing one tree into several collections gives each its own documents.
+    """
+    key = os.path.abspath(path)
+    if collection != "default":     # default keeps the path-only ids of earlier runs
+        key = f"{collection}:{key}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+
+
+def cmd_index(args) -> int:
+    from backend.settings import DOC_STORE_PATH
+    from backend.utils.dedupe import file_hash_path
+    from backend.utils.doc_loader import load_pages_from_path
+    from backend.rag.index import build_or_update_index, delete_documents
+    from backend.store.doc_store import DocStore
+
+    paths = list(_iter_files(args.root))
+    doc_store = DocStore(DOC_STORE_PATH)
+    bar = tqdm(total=len(paths), desc="Indexing", unit="file")
+    failed, done = [], []
+
+    def _load(path):
+        try:
+            return path, load_pages_from_path(path), file_hash_path(path), None
+        except Exception as e:
+            return path, None, None, e
+
+    def _docs():
+        for path, pages, sha, err in bounded_map(_load, paths, args.workers):
+            bar.update(1)
+            bar.set_postfix_str(os.path.basename(path)[:40])
+            if err is not None:
+                failed.append(path)
+                tqdm.write(f"Failed to read {path}: {err}")
+                continue
+            doc_id = _doc_id_for(path, args.collection)
+            info = doc_store.get(doc_id)
+            if not (info and info["sha"] == sha and info["indexed"]):
+                # unchanged, indexed docs keep their row, so the app doesn't see them as pending
+                doc_store.put(doc_id, os.path.basename(path), path, pages, sha=sha, collection=args.collection)
+                done.append(doc_id)
+            yield {"doc_id": doc_id, "text": "\n".join(pages), "source_path": path}
+
+    vs, _ = build_or_update_index(_docs(), collection=args.collection, background_compact=False)
+    doc_store.mark_indexed(done)
+    bar.close()
+
+    if args.prune:
+        root = os.path.join(os.path.abspath(args.root), "")     # trailing separator
+        gone = [did for did in vs.doc_ids()
+                for m in vs.live_chunks(did)[:1]
+                for path in [vs.doc_ref(m, did)["source_path"] or ""]
+                if path.startswith(root) and not os.path.exists(path)]
+        if gone:
+            delete_documents(gone, vs, background_compact=False)
+            for did in gone:
+                doc_store.delete(did, collection=args.collection)
+        print(f"Pruned {len(gone)} removed document(s).")
+
+    print(f"Indexed {len(paths) - len(failed)}/{len(paths)} file(s); {len(vs)} chunks in index.")
+    return 1 if failed else 0
+
+
+# -------------------- ask --------------------
+def _read_questions(path: str) -> Iterator[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for i, row in enumerate(rows):
+            q = (row.get("question") or "").strip()
+            if q:
+                yield {"id": str(row.get("id") or i), "question": q}
+
+
+def cmd_ask(args) -> int:
+    from backend.rag.index import load_index, list_collections
+    from backend.rag.qa import route_and_answer
+    from backend.store.sharded_store import ShardedStore
+
+    vs = ShardedStore(load_index).view(args.collection or list_collections())
+
+    def _answer(row):
+        t0 = time.perf_counter()
+        try:
+            ans, files, used_docs, score = route_and_answer(row["question"], vs, min_sim=args.min_sim)
+            err = ""
+        except Exception as e:
+            ans, files, used_docs, score, err = "", [], False, 0.0, str(e)
+        return {
+            **row,
+            "answer": ans,
+            "sources": files,
+            "used_docs": used_docs,
+            "score": round(float(score), 4),
+            "seconds": round(time.perf_counter() - t0, 3),
+            "error": err,
+        }
+
+    out = open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout
+    as_csv = bool(args.out) and args.out.lower().endswith(".csv")
+    writer = None
+    n_err = 0
+    try:
+        for res in tqdm(bounded_map(_answer, _read_questions(args.questions), args.workers),
+                        desc="Answering", unit="q", file=sys.stderr):
+            n_err += bool(res["error"])
+            if as_csv:
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=list(res))
+                    writer.writeheader()
+                writer.writerow({**res, "sources": "; ".join(res["sources"])})
+            else:
+                out.write(json.dumps(res, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if n_err else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="docuchat", description="DocuChat batch tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("index", help="Index every supported file under a directory")
+    p.add_argument("root", help="Directory to walk")
+    p.add_argument("--workers", type=int, default=4, help="Parallel file parsers (default 4)")
+    p.add_argument("--prune", action="store_true",
+                   help="Delete indexed documents under ROOT whose files no longer exist")
+    p.add_argument("--collection", default="default", help="Collection to index into (default: default)")
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser("ask", help="Answer a CSV/JSONL file of questions")
+    p.add_argument("questions", help="CSV with a 'question' column, or JSONL with a 'question' key")
+    p.add_argument("--out", help="Output .jsonl or .csv (default: JSONL to stdout)")
+    p.add_argument("--workers", type=int, default=4, help="Questions in flight (default 4)")
+    p.add_argument("--min-sim", type=float, default=0.28, help="Auto-router RAG threshold")
+    p.add_argument("--collection", action="append",
+                   help="Collection to search (repeatable; default: all collections)")
+    p.set_defaults(func=cmd_ask)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())